@@ -22,6 +22,11 @@ class Settings:
     pupil_topic: str = os.getenv("PUPIL_TOPIC", "gaze.")
     pupil_confidence_threshold: float = float(os.getenv("PUPIL_CONFIDENCE_THRESHOLD", "0.6"))
     pupil_surface_name: str = os.getenv("PUPIL_SURFACE_NAME", "screen")
+    # Optional JSONL file that /patch/use records are appended to in the background.
+    patch_usage_log_path: Path | None = (
+        Path(os.environ["PATCH_USAGE_LOG"]).resolve() if os.getenv("PATCH_USAGE_LOG") else None
+    )
+    patch_usage_flush_seconds: float = float(os.getenv("PATCH_USAGE_FLUSH_SECONDS", "5"))
 
 
 @lru_cache(maxsize=1)
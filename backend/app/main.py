@@ -2,12 +2,15 @@ from __future__ import annotations
 
 import asyncio
 import logging
+from collections import deque
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import Any
 
+import orjson
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 
 from .config import get_settings
@@ -29,39 +32,56 @@ app.add_middleware(
 )
 app.mount("/assets", StaticFiles(directory=str(settings.patch_dir)), name="assets")
 
-stream_hub = StreamHub(history_size=settings.telemetry_history)
+stream_hub = StreamHub()
 patch_manager = PatchManager(settings.patch_dir)
 pupil_source = PupilSource(settings, stream_hub.broadcast)
-patch_usage_log: list[dict[str, Any]] = []
+# Recent usage stays in memory (bounded); older records only live in the optional JSONL file.
+patch_usage_log: deque[dict[str, Any]] = deque(maxlen=settings.telemetry_history)
+_pending_usage: list[dict[str, Any]] = []
+_usage_flush_task: asyncio.Task[None] | None = None
+_ping_task: asyncio.Task[None] | None = None
+_healthz_cache: tuple[tuple[float | None, int], bytes] | None = None
 
 
 @app.on_event("startup")
 async def _startup() -> None:
+    global _usage_flush_task, _ping_task
     logger.info("Starting backend...")
     await patch_manager.load()
     await pupil_source.start()
+    _ping_task = asyncio.create_task(_ping_clients())
+    if settings.patch_usage_log_path is not None:
+        logger.info("Appending patch usage to %s", settings.patch_usage_log_path)
+        _usage_flush_task = asyncio.create_task(_flush_patch_usage_periodically())
 
 
 @app.on_event("shutdown")
 async def _shutdown() -> None:
     logger.info("Stopping backend")
     await pupil_source.stop()
+    if _ping_task is not None:
+        _ping_task.cancel()
+    if _usage_flush_task is not None:
+        _usage_flush_task.cancel()
+        await _flush_patch_usage()
 
 
 @app.get("/healthz")
-async def healthz() -> dict[str, Any]:
-    return {
-        "status": "ok",
-        "latest_sample_ts": stream_hub.latest_sample.get("ts") if stream_hub.latest_sample else None,
-        "connected_clients": len(stream_hub.clients),
-    }
+async def healthz() -> Response:
+    global _healthz_cache
+    # The body only changes with new telemetry or a client (dis)connect.
+    key = (stream_hub.latest_sample_ts, len(stream_hub.clients))
+    if _healthz_cache is None or _healthz_cache[0] != key:
+        body = orjson.dumps({"status": "ok", "latest_sample_ts": key[0], "connected_clients": key[1]})
+        _healthz_cache = (key, body)
+    return Response(content=_healthz_cache[1], media_type="application/json")
 
 
 @app.get("/telemetry/latest")
-async def latest_sample() -> JSONResponse:
-    if not stream_hub.latest_sample:
+async def latest_sample() -> Response:
+    if stream_hub.latest_sample_bytes is None:
         raise HTTPException(status_code=404, detail="No telemetry yet")
-    return JSONResponse(stream_hub.latest_sample)
+    return Response(content=stream_hub.latest_sample_bytes, media_type="application/json")
 
 
 @app.get("/patch/next")
@@ -76,27 +96,51 @@ async def register_patch_use(event: dict[str, Any]) -> dict[str, Any]:
         "payload": event,
     }
     patch_usage_log.append(record)
+    if settings.patch_usage_log_path is not None:
+        _pending_usage.append(record)
     return record
 
 
 @app.websocket("/ws/stream")
 async def websocket_stream(websocket: WebSocket) -> None:
-    await stream_hub.register(websocket)
-    ping_task = asyncio.create_task(_ping_client(websocket))
+    # ?compress=deflate opts into pre-compressed binary frames for large payloads.
+    compress = websocket.query_params.get("compress") == "deflate"
+    await stream_hub.register(websocket, compress=compress)
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
     finally:
-        ping_task.cancel()
         await stream_hub.unregister(websocket)
 
 
-async def _ping_client(websocket: WebSocket) -> None:
+async def _ping_clients() -> None:
+    # One timer for all connections; pings ride the regular hub fan-out.
+    while True:
+        await asyncio.sleep(30)
+        await stream_hub.broadcast({"event": "ping"}, record=False)
+
+
+async def _flush_patch_usage_periodically() -> None:
+    while True:
+        await asyncio.sleep(settings.patch_usage_flush_seconds)
+        await _flush_patch_usage()
+
+
+async def _flush_patch_usage() -> None:
+    if not _pending_usage or settings.patch_usage_log_path is None:
+        return
+    records = _pending_usage[:]
+    _pending_usage.clear()
+    lines = b"".join(orjson.dumps(record) + b"\n" for record in records)
     try:
-        while True:
-            await asyncio.sleep(30)
-            await websocket.send_json({"event": "ping"})
-    except Exception:
-        pass
+        await asyncio.to_thread(_append_bytes, settings.patch_usage_log_path, lines)
+    except OSError as exc:
+        logger.warning("Failed to write patch usage log: %s", exc)
+
+
+def _append_bytes(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("ab") as handle:
+        handle.write(data)
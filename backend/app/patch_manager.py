@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-import asyncio
 import json
+from collections import defaultdict
 from pathlib import Path
 from typing import Any
 
@@ -11,9 +11,10 @@ class PatchManager:
 
     def __init__(self, assets_root: Path) -> None:
         self.assets_root = assets_root
-        self._lock = asyncio.Lock()
         self._manifest: list[dict[str, Any]] = []
-        self._cursor = 0
+        # stimulus -> manifest entries, built once per load
+        self._by_stimulus: dict[str, list[dict[str, Any]]] = {}
+        self._cursors: defaultdict[str | None, int] = defaultdict(int)
 
     async def load(self) -> None:
         manifest_file = self.assets_root / "manifest.json"
@@ -48,15 +49,19 @@ class PatchManager:
                 "No patch assets found. Add SVG/PNG assets or a manifest.json inside ''%s''."
                 % self.assets_root
             )
+        by_stimulus: dict[str, list[dict[str, Any]]] = {}
+        for item in self._manifest:
+            by_stimulus.setdefault(item.get("stimulus"), []).append(item)
+        self._by_stimulus = by_stimulus
+        self._cursors.clear()
 
     async def next_patch(self, stimulus: str | None = None) -> dict[str, Any]:
-        async with self._lock:
-            if stimulus:
-                filtered = [item for item in self._manifest if item.get("stimulus") == stimulus]
-            else:
-                filtered = self._manifest
-            if not filtered:
-                raise ValueError(f"No patches found for stimulus '{stimulus}'.")
-            selection = filtered[self._cursor % len(filtered)]
-            self._cursor += 1
-            return selection
+        # No lock needed: the cursor bump never awaits, so each call runs to
+        # completion on the event loop.
+        key = stimulus or None
+        filtered = self._by_stimulus.get(key) if key else self._manifest
+        if not filtered:
+            raise ValueError(f"No patches found for stimulus '{stimulus}'.")
+        cursor = self._cursors[key] % len(filtered)
+        self._cursors[key] = (cursor + 1) % len(filtered)
+        return filtered[cursor]
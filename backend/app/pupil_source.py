@@ -2,19 +2,55 @@ from __future__ import annotations
 
 import asyncio
 import logging
-import threading
 import time
 from contextlib import suppress
 from typing import Callable
 
-import msgpack  # type: ignore
+import msgspec
 import zmq
+import zmq.asyncio
+from zmq.utils.monitor import parse_monitor_message
 
-from .blink_utils import clamp
 from .config import Settings
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on frames read per socket per poll wakeup, so one busy topic
+# cannot starve the other or delay the broadcast indefinitely.
+MAX_DRAIN_PER_TICK = 64
+# Receive high-water mark for each SUB socket (pyzmq default is 1000). At the
+# mark ZMQ keeps what is queued and discards new frames, so it is set high
+# enough that a stall on the event loop queues a burst instead of losing it.
+SUB_RCVHWM = 10000
+# Subscription prefixes, kept as bytes for setsockopt.
+SURFACE_TOPIC = b"surface"
+BLINK_TOPIC = b"blinks"
+# Seconds to wait for Pupil Remote to answer the SUB_PORT request.
+REMOTE_TIMEOUT_S = 2.0
+# Backoff bounds (seconds) between attempts to reach Pupil Remote.
+CONNECT_RETRY_MIN_S = 1.0
+CONNECT_RETRY_MAX_S = 30.0
+
+
+# Typed schemas for the Pupil messages we read. Decoding straight into these
+# skips building dicts for the fields we ignore (e.g. each gaze point's
+# nested base_data); unknown fields are dropped.
+class GazeOnSurface(msgspec.Struct):
+    norm_pos: tuple[float, float] = (0.5, 0.5)
+    confidence: float = 0.0
+    timestamp: float | None = None
+
+
+class SurfaceMessage(msgspec.Struct):
+    name: str = "unknown"
+    gaze_on_surfaces: list[GazeOnSurface] = []
+
+
+class BlinkMessage(msgspec.Struct):
+    type: str | None = None
+    timestamp: float | None = None
+    timestamp_epoch: float | None = None
+
 
 class PupilSource:
     """
@@ -32,139 +68,230 @@ class PupilSource:
     def __init__(self, settings: Settings, broadcast_callback: Callable):
         self._settings = settings
         self._broadcast = broadcast_callback
-        self._stop_event = threading.Event()
-        self._thread = threading.Thread(target=self._run, name="pupil-core-source", daemon=True)
+        self._task: asyncio.Task[None] | None = None
         # Name of the surface defined in Pupil Capture's Surface Tracker
         self.surface_name = settings.pupil_surface_name if hasattr(settings, 'pupil_surface_name') else "screen"
 
     async def start(self):
         logger.info("Starting Pupil Core source...")
         logger.info(f"Surface name for gaze mapping: '{self.surface_name}'")
-        self._stop_event.clear()
-        self._thread.start()
+        # The subscriber runs as a task on the server loop, so broadcasts are
+        # awaited directly instead of hopping across threads.
+        self._task = asyncio.create_task(self._run(), name="pupil-core-source")
 
     async def stop(self):
         logger.info("Stopping Pupil Core source...")
-        self._stop_event.set()
-        self._thread.join(timeout=5)
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # A source that already died must not abort the rest of shutdown.
+            logger.exception("Pupil Core source exited with an error")
+        self._task = None
 
-    def _run(self) -> None:
-        ctx = zmq.Context.instance()
+    async def _request_sub_port(self, ctx: zmq.asyncio.Context) -> str:
+        """Ask Pupil Remote for its SUB port; raises RuntimeError if it does not answer."""
         request_socket = ctx.socket(zmq.REQ)
+        request_socket.setsockopt(zmq.LINGER, 0)
         remote_address = f"tcp://{self._settings.pupil_host}:{self._settings.pupil_remote_port}"
         request_socket.connect(remote_address)
         logger.info(f"Connecting to Pupil Remote at {remote_address}")
 
         try:
-            request_socket.send_string("SUB_PORT")
-            sub_port = request_socket.recv_string()
+            # Bounded so an unresponsive Pupil Capture raises instead of
+            # leaving this task parked forever on the reply.
+            await asyncio.wait_for(request_socket.send_string("SUB_PORT"), REMOTE_TIMEOUT_S)
+            sub_port = await asyncio.wait_for(request_socket.recv_string(), REMOTE_TIMEOUT_S)
             logger.info(f"Received Pupil SUB_PORT={sub_port}")
         except Exception as exc:
-            request_socket.close(0)
             raise RuntimeError(
                 "Unable to reach the Pupil Remote plugin. Ensure Pupil Capture/Core is running "
                 "with Remote enabled and that the host/port are correct."
             ) from exc
+        finally:
+            request_socket.close(0)
+        return sub_port
+
+    async def _wait_for_sub_port(self, ctx: zmq.asyncio.Context) -> str:
+        """Request the SUB port until Pupil Remote answers, backing off between attempts."""
+        delay = CONNECT_RETRY_MIN_S
+        while True:
+            try:
+                return await self._request_sub_port(ctx)
+            except RuntimeError as exc:
+                # Warn once per outage; repeated attempts only show up at debug level.
+                log = logger.warning if delay == CONNECT_RETRY_MIN_S else logger.debug
+                log(f"{exc} Retrying in {delay:.0f}s.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CONNECT_RETRY_MAX_S)
 
+    def _open_sub_socket(self, ctx: zmq.asyncio.Context, sub_port: str, topic: bytes) -> zmq.asyncio.Socket:
         sub_address = f"tcp://{self._settings.pupil_host}:{sub_port}"
-        
-        # Subscribe to surface gaze ONLY (from Marker Mapper / Surface Tracker)
-        # No raw gaze subscription - we rely entirely on surface-mapped coordinates
-        surface_socket = ctx.socket(zmq.SUB)
-        surface_socket.connect(sub_address)
-        surface_socket.setsockopt_string(zmq.SUBSCRIBE, "surface")
-        logger.info(f"Subscribed to 'surface*' topics on {sub_address}")
+        sub_socket = ctx.socket(zmq.SUB)
+        sub_socket.setsockopt(zmq.RCVHWM, SUB_RCVHWM)  # must precede connect
+        sub_socket.setsockopt(zmq.LINGER, 0)
+        sub_socket.connect(sub_address)
+        sub_socket.setsockopt(zmq.SUBSCRIBE, topic)
+        logger.info(f"Subscribed to '{topic.decode()}*' topics on {sub_address}")
+        return sub_socket
+
+    async def _run(self) -> None:
+        ctx = zmq.asyncio.Context.instance()
         logger.info(f"Looking for surface named: '{self.surface_name}'")
         logger.info("Configure Surface Tracker in Pupil Capture with AprilTags at screen corners!")
+        while True:
+            # The first connect and every reconnect share the same retrying handshake,
+            # so Pupil Capture restarting on a new SUB port is picked up as well.
+            sub_port = await self._wait_for_sub_port(ctx)
+            await self._stream(ctx, sub_port)
+            logger.debug("Pupil SUB connection dropped; requesting SUB_PORT again")
+
+    async def _stream(self, ctx: zmq.asyncio.Context, sub_port: str) -> None:
+        """Forward Pupil frames until the SUB connection to Pupil Capture drops."""
+        # Subscribe to surface gaze ONLY (from Marker Mapper / Surface Tracker)
+        # No raw gaze subscription - we rely entirely on surface-mapped coordinates
+        surface_socket = self._open_sub_socket(ctx, sub_port, SURFACE_TOPIC)
+        # Blinks get their own socket, and with it their own receive queue, so a
+        # burst of gaze can never push a blink onset past the high-water mark.
+        blink_socket = self._open_sub_socket(ctx, sub_port, BLINK_TOPIC)
+        # Reconnect on connection state, not payload silence: an empty stream is
+        # normal whenever the surface is out of view. Both sockets share the peer,
+        # so watching one of them is enough.
+        monitor = surface_socket.get_monitor_socket(zmq.EVENT_DISCONNECTED)
 
-        # Subscribe to blinks
-        blink_socket = ctx.socket(zmq.SUB)
-        blink_socket.connect(sub_address)
-        blink_socket.setsockopt_string(zmq.SUBSCRIBE, "blinks")
-        logger.info(f"Subscribed to blink topic 'blinks' on {sub_address}")
+        decode_surface = msgspec.msgpack.Decoder(SurfaceMessage).decode
+        decode_blink = msgspec.msgpack.Decoder(BlinkMessage).decode
 
-        poller = zmq.Poller()
+        poller = zmq.asyncio.Poller()
         poller.register(surface_socket, zmq.POLLIN)
         poller.register(blink_socket, zmq.POLLIN)
+        poller.register(monitor, zmq.POLLIN)
 
-        last_log = time.monotonic()
+        monotonic = time.monotonic
+        last_log = monotonic()
         samples_forwarded = 0
         surface_samples = 0
+        # Bound once: these are read for every gaze point in the loop below
+        confidence_threshold = self._settings.pupil_confidence_threshold
+        wall_time = time.time
+        recv_surface = surface_socket.recv_multipart
+        recv_blink = blink_socket.recv_multipart
+        broadcast = self._broadcast
+        poll = poller.poll
 
-        while not self._stop_event.is_set():
-            try:
-                socks = dict(poller.poll(timeout=100))
-            except zmq.ZMQError:
-                break
-
-            if not socks:
-                continue
-
-            # Prefer surface gaze data (already mapped to screen by Pupil Capture)
-            if surface_socket in socks:
-                frames = surface_socket.recv_multipart(flags=zmq.NOBLOCK)
-                if len(frames) >= 1:
-                    topic = frames[0].decode('utf-8', errors='ignore')
-                    # Log first few surface messages to help diagnose
-                    if surface_samples < 5:
-                        logger.info(f"Surface topic received: '{topic}'")
-                    
-                if len(frames) >= 2:
-                    surface_obj = msgpack.loads(frames[1], raw=False)
-                    if isinstance(surface_obj, dict):
+        try:
+            while True:
+                try:
+                    socks = dict(await poll())
+                except zmq.ZMQError:
+                    break
+
+                if monitor in socks:
+                    event = parse_monitor_message(await monitor.recv_multipart())
+                    if event["event"] == zmq.EVENT_DISCONNECTED:
+                        return
+
+                # Everything received in this poll tick is forwarded as one message.
+                batch: list[dict] = []
+                append = batch.append
+
+                # Prefer surface gaze data (already mapped to screen by Pupil Capture)
+                if surface_socket in socks:
+                    # Drain everything queued on this socket in one wakeup
+                    for _ in range(MAX_DRAIN_PER_TICK):
+                        try:
+                            frames = await recv_surface(flags=zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        if len(frames) < 2:
+                            continue
+
+                        # Log first few surface messages to help diagnose (the topic
+                        # frame stays bytes otherwise; the SUB filter already matched it)
+                        if surface_samples < 5:
+                            topic = frames[0].decode('utf-8', errors='ignore')
+                            logger.info(f"Surface topic received: '{topic}'")
+
+                        try:
+                            surface_obj = decode_surface(frames[1])
+                        except msgspec.MsgspecError as exc:
+                            logger.debug(f"Skipping undecodable surface message: {exc}")
+                            continue
                         # Log what we received to understand the data structure
-                        surface_name = surface_obj.get("name", "unknown")
                         if surface_samples < 5:
-                            logger.info(f"Surface message: name='{surface_name}', keys={list(surface_obj.keys())}")
-                        
+                            logger.info(
+                                f"Surface message: name='{surface_obj.name}', "
+                                f"gaze points={len(surface_obj.gaze_on_surfaces)}"
+                            )
+
                         # Surface data structure from Pupil Core:
                         # - name: surface name
                         # - gaze_on_surfaces: list of [{norm_pos: [x,y], confidence: float, ...}]
-                        gaze_on_surfaces = surface_obj.get("gaze_on_surfaces", [])
+                        gaze_on_surfaces = surface_obj.gaze_on_surfaces
                         for gaze_pt in gaze_on_surfaces:
-                            norm_pos = gaze_pt.get("norm_pos", [0.5, 0.5])
-                            confidence = float(gaze_pt.get("confidence", 0.0))
-                            
                             # Pupil Capture Surface Tracker uses OpenGL convention:
                             # (0,0) = bottom-left, (1,1) = top-right
                             # Screen coords: (0,0) = top-left, (1,1) = bottom-right
                             # So we MUST flip Y!
-                            x_norm = clamp(float(norm_pos[0]))
-                            y_norm = clamp(1.0 - float(norm_pos[1]))  # Flip Y for screen coords
-                            
-                            valid = confidence >= self._settings.pupil_confidence_threshold
-                            ts = float(gaze_pt.get("timestamp", time.time()))
-                            
-                            gaze_payload = {"x_norm": x_norm, "y_norm": y_norm, "valid": valid}
-                            asyncio.run(self._broadcast({"ts": ts, "event": "sample", "gaze": gaze_payload}))
-                            samples_forwarded += 1
-                            surface_samples += 1
-
-            if blink_socket in socks:
-                frames = blink_socket.recv_multipart(flags=zmq.NOBLOCK)
-                if len(frames) >= 2:
-                    blink_obj = msgpack.loads(frames[1], raw=False)
-                    if isinstance(blink_obj, dict):
-                        blink_type = blink_obj.get("type")
-                        blink_state = "closed" if blink_type == "onset" else "open"
-                        ts_raw = blink_obj.get("timestamp") or blink_obj.get("timestamp_epoch")
-                        ts = float(ts_raw) if ts_raw is not None else time.time()
-                        asyncio.run(self._broadcast({"ts": ts, "event": "blink", "state": blink_state}))
-
-            now = time.monotonic()
-            if now - last_log >= 5:
-                if surface_samples > 0:
-                    source = f"surface '{self.surface_name}' ({surface_samples} pts)"
-                else:
-                    source = "no surface data - check Surface Tracker setup!"
-                logger.info(f"Forwarded {samples_forwarded} gaze samples - source: {source}")
-                last_log = now
-                samples_forwarded = 0
-                surface_samples = 0
-
-        with suppress(Exception):
-            surface_socket.close(0)
-        with suppress(Exception):
-            blink_socket.close(0)
-        with suppress(Exception):
-            request_socket.close(0)
+                            x, y = gaze_pt.norm_pos
+                            y = 1.0 - y
+                            # Clamp inline: messages carry only a few points, so
+                            # a function call costs more than the math
+                            x = 0.0 if x < 0.0 else (1.0 if x > 1.0 else x)
+                            y = 0.0 if y < 0.0 else (1.0 if y > 1.0 else y)
+                            # Only read the clock when the sample carries no timestamp
+                            ts = gaze_pt.timestamp if gaze_pt.timestamp is not None else wall_time()
+
+                            append({"ts": ts, "event": "sample", "gaze": {"x_norm": x, "y_norm": y, "valid": gaze_pt.confidence >= confidence_threshold}})
+                        samples_forwarded += len(gaze_on_surfaces)
+                        surface_samples += len(gaze_on_surfaces)
+
+                if blink_socket in socks:
+                    # Drain everything queued on this socket in one wakeup
+                    for _ in range(MAX_DRAIN_PER_TICK):
+                        try:
+                            frames = await recv_blink(flags=zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        if len(frames) < 2:
+                            continue
+                        try:
+                            blink_obj = decode_blink(frames[1])
+                        except msgspec.MsgspecError as exc:
+                            logger.debug(f"Skipping undecodable blink message: {exc}")
+                            continue
+                        blink_state = "closed" if blink_obj.type == "onset" else "open"
+                        ts_raw = blink_obj.timestamp or blink_obj.timestamp_epoch
+                        ts = ts_raw if ts_raw is not None else wall_time()
+                        append({"ts": ts, "event": "blink", "state": blink_state})
+
+                if len(batch) == 1:
+                    await broadcast(batch[0])
+                elif batch:
+                    # Take the last item's timestamp rather than a max(): gaze and
+                    # blink timestamps may come from different clocks.
+                    await broadcast({"ts": batch[-1]["ts"], "event": "batch", "samples": batch})
+
+                now = monotonic()
+                if now - last_log >= 5:
+                    if surface_samples > 0:
+                        source = f"surface '{self.surface_name}' ({surface_samples} pts)"
+                    else:
+                        source = "no surface data - check Surface Tracker setup!"
+                    logger.info(f"Forwarded {samples_forwarded} gaze samples - source: {source}")
+                    last_log = now
+                    samples_forwarded = 0
+                    surface_samples = 0
+        finally:
+            with suppress(Exception):
+                surface_socket.disable_monitor()
+            with suppress(Exception):
+                monitor.close(0)
+            with suppress(Exception):
+                surface_socket.close(0)
+            with suppress(Exception):
+                blink_socket.close(0)
@@ -2,44 +2,115 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from collections import deque
-from typing import Any
+import zlib
+from contextlib import suppress
+from typing import Any, Iterable
 
+import orjson
 from fastapi import WebSocket
 
 logger = logging.getLogger(__name__)
 
+# Frames buffered per client before it is considered too slow and dropped.
+CLIENT_QUEUE_SIZE = 256
+# Payloads at least this large are deflated once and sent as binary frames to
+# clients that opted in, instead of each connection compressing them again.
+COMPRESS_MIN_BYTES = 512
+
+Frame = str | bytes
+ClientEntry = tuple["asyncio.Queue[Frame]", "asyncio.Task[None]", bool]
+
 
 class StreamHub:
     """Fan-out hub that keeps track of websocket clients and latest telemetry."""
 
-    def __init__(self, history_size: int = 512) -> None:
-        self.clients: set[WebSocket] = set()
-        self.latest_sample: dict[str, Any] | None = None
-        self.history: deque[dict[str, Any]] = deque(maxlen=history_size)
+    def __init__(self) -> None:
+        # Each client owns a bounded outbound queue drained by its own writer task,
+        # so a slow socket never stalls the producer or the other clients.
+        self.clients: dict[WebSocket, ClientEntry] = {}
+        # Clients that overflowed during a broadcast; removed once the fan-out is done.
+        self._pending_remove: set[WebSocket] = set()
+        # Strong references to in-flight close tasks so they are not collected mid-close.
+        self._close_tasks: set[asyncio.Task[None]] = set()
+        # Telemetry is kept pre-encoded; only the timestamp is retained as a value.
+        self.latest_sample_ts: float | None = None
+        self.latest_sample_bytes: bytes | None = None
         self._lock = asyncio.Lock()
 
-    async def register(self, websocket: WebSocket) -> None:
+    async def register(self, websocket: WebSocket, *, compress: bool = False) -> None:
+        """Accept a client; ``compress`` clients receive large frames as binary zlib data."""
         await websocket.accept()
+        queue: asyncio.Queue[Frame] = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
         async with self._lock:
-            self.clients.add(websocket)
-        await websocket.send_json({"event": "ready", "clients": len(self.clients)})
+            queue.put_nowait(orjson.dumps({"event": "ready", "clients": len(self.clients) + 1}).decode())
+            task = asyncio.create_task(self._writer(websocket, queue))
+            self.clients[websocket] = (queue, task, compress)
 
     async def unregister(self, websocket: WebSocket) -> None:
         async with self._lock:
-            self.clients.discard(websocket)
+            self._drop(websocket)
 
-    async def broadcast(self, payload: dict[str, Any]) -> None:
-        self.latest_sample = payload
-        self.history.append(payload)
-        dead_clients: list[WebSocket] = []
-        for client in list(self.clients):
-            try:
-                await client.send_json(payload)
-            except Exception as exc:  # fastapi raises WebSocketDisconnect
-                logger.debug("websocket send failed: %s", exc)
-                dead_clients.append(client)
-        if dead_clients:
+    async def broadcast(self, payload: dict[str, Any], *, record: bool = True) -> None:
+        """Fan ``payload`` out to every client; ``record=False`` skips latest telemetry (e.g. pings)."""
+        # Encode once and share the same frame across telemetry and every client.
+        encoded = orjson.dumps(payload)
+        if record:
+            if payload.get("event") == "batch":
+                # Telemetry keeps reporting one sample, not the whole batch
+                latest = payload["samples"][-1]
+                self.latest_sample_ts = latest.get("ts")
+                self.latest_sample_bytes = orjson.dumps(latest)
+            else:
+                self.latest_sample_ts = payload.get("ts")
+                self.latest_sample_bytes = encoded
+        message = encoded.decode()
+        compressed: bytes | None = None
+        if len(encoded) >= COMPRESS_MIN_BYTES and any(entry[2] for entry in self.clients.values()):
+            compressed = zlib.compress(encoded, 1)
+        # Nothing awaits inside this loop, so the dict can be walked without a copy.
+        self._enqueue(self.clients.items(), message, compressed)
+        if self._pending_remove:
+            dead_clients = list(self._pending_remove)
+            self._pending_remove.clear()
             async with self._lock:
                 for client in dead_clients:
-                    self.clients.discard(client)
+                    self._drop(client)
+            for client in dead_clients:
+                # Close in the background so the client reconnects instead of idling.
+                task = asyncio.create_task(_close_quietly(client))
+                self._close_tasks.add(task)
+                task.add_done_callback(self._close_tasks.discard)
+
+    def _enqueue(
+        self, entries: Iterable[tuple[WebSocket, ClientEntry]], message: str, compressed: bytes | None
+    ) -> None:
+        for client, (queue, _, compress) in entries:
+            try:
+                queue.put_nowait(compressed if compress and compressed is not None else message)
+            except asyncio.QueueFull:
+                logger.info("websocket client fell %d frames behind; disconnecting", CLIENT_QUEUE_SIZE)
+                self._pending_remove.add(client)
+
+    def _drop(self, websocket: WebSocket) -> None:
+        entry = self.clients.pop(websocket, None)
+        if entry is not None and entry[1] is not asyncio.current_task():
+            entry[1].cancel()
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue[Frame]) -> None:
+        try:
+            while True:
+                message = await queue.get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # fastapi raises WebSocketDisconnect
+            logger.debug("websocket send failed: %s", exc)
+            self._drop(websocket)
+
+
+async def _close_quietly(websocket: WebSocket) -> None:
+    with suppress(Exception):
+        await websocket.close(code=1013)
@@ -1,5 +1,7 @@
 const API_ROOT = window.API_ROOT || "http://localhost:8000";
-const WS_URL = API_ROOT.replace("http", "ws") + "/ws/stream";
+// Large frames arrive as binary zlib data; small ones stay plain JSON text
+const WS_URL = API_ROOT.replace("http", "ws") + "/ws/stream" +
+  (typeof DecompressionStream === "function" ? "?compress=deflate" : "");
 const GENERATION_API = window.GENERATION_API || "http://localhost:8001";
 
 // Debug mode - toggle with ?debug=true in URL or press 'D' key
@@ -266,7 +268,8 @@ async function generateForSector(focusSector, targetSector) {
   
   const response = await fetch(`${GENERATION_API}/generate`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    // WebP responses encode faster and transfer smaller than PNG
+    headers: { "Content-Type": "application/json", "Accept": "image/webp, image/png" },
     body: JSON.stringify({
       image_base64: capturedImageBase64,
       focus_x: focusCenter.x_norm,
@@ -344,7 +347,8 @@ async function generateToPending(focusX, focusY, modifiedRegion) {
   
   const response = await fetch(`${GENERATION_API}/generate`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    // WebP responses encode faster and transfer smaller than PNG
+    headers: { "Content-Type": "application/json", "Accept": "image/webp, image/png" },
     body: JSON.stringify({
       image_base64: capturedImageBase64,
       focus_x: focusX,
@@ -433,6 +437,20 @@ function handleBlink(state) {
 // WEBSOCKET
 // ============================================
 
+function handleStreamEvent(data) {
+  if (data.event === "sample" && data.gaze?.valid) {
+    updateGazeCursor(data.gaze);
+  } else if (data.event === "blink" && data.state) {
+    handleBlink(data.state);
+  }
+}
+
+async function decodeFrame(raw) {
+  if (typeof raw === "string") return JSON.parse(raw);
+  const inflated = raw.stream().pipeThrough(new DecompressionStream("deflate"));
+  return JSON.parse(await new Response(inflated).text());
+}
+
 function connectWebSocket() {
   const socket = new WebSocket(WS_URL);
   console.log("WebSocket connecting...");
@@ -442,13 +460,20 @@ function connectWebSocket() {
     setInterval(() => socket.readyState === 1 && socket.send("ping"), 10000);
   });
 
+  // Chain decoding so inflated binary frames keep their order with text frames
+  let inbound = Promise.resolve();
   socket.addEventListener("message", (event) => {
-    const data = JSON.parse(event.data);
-    if (data.event === "sample" && data.gaze?.valid) {
-      updateGazeCursor(data.gaze);
-    } else if (data.event === "blink" && data.state) {
-      handleBlink(data.state);
-    }
+    inbound = inbound
+      .then(() => decodeFrame(event.data))
+      .then((data) => {
+        if (data.event === "batch") {
+          // Backend merges everything from one poll tick into a single frame
+          data.samples.forEach(handleStreamEvent);
+        } else {
+          handleStreamEvent(data);
+        }
+      })
+      .catch((err) => console.error("Bad stream frame:", err));
   });
 
   socket.addEventListener("close", () => {
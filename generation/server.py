@@ -1,17 +1,33 @@
 import argparse
+import array
+import asyncio
 import io
 import os
-import base64
-import httpx
-import json
+import sys
+import functools
+import random
+import time
+import hashlib
+import math
+import aiohttp
+import numpy as np
+import orjson
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from types import MappingProxyType
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFile
 import uvicorn
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple, Union
+
+try:
+    import pybase64 as base64  # SIMD codec, drop-in for the large image payloads
+except ImportError:  # pybase64 is optional; fall back to the stdlib codec
+    import base64
 
 from session_manager import SessionManager, ReplayManager
 
@@ -26,12 +42,15 @@ app.add_middleware(
     allow_credentials=True,
 )
 
-# Global state
-prompts = []
+# Global state (prompt tables are parsed once at startup into immutable tuples)
+prompts = ()
 prompt_index = 0
-sector_prompts = {}  # Sector-specific prompts (can be string or list)
-sector_prompt_indices = {}  # Track cycling index per sector
-default_prompts = ["add more detail, photorealistic, seamless blend"]
+sector_prompts = MappingProxyType({})  # Sector-specific prompts (string or tuple)
+# Per-sector lookup: name -> (slot, prompt string or tuple); cycling index per slot
+sector_prompt_slots = MappingProxyType({})
+sector_prompt_lut = MappingProxyType({})  # (row, col) -> same entries, for 3x3 grid sectors
+sector_prompt_indices = array.array('I')
+default_prompts = ("add more detail, photorealistic, seamless blend",)
 default_prompt_index = 0
 PROMPTS_FILE = Path(__file__).parent / "prompts.txt"
 SECTOR_PROMPTS_FILE = Path(__file__).parent / "sector_prompts.json"
@@ -41,20 +60,88 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 # Image generation model - options: "openai/dall-e-3", "stability/stable-diffusion-xl"
 IMAGE_MODEL = os.getenv("OPENROUTER_IMAGE_MODEL", "google/gemini-2.5-flash-image")
+# Quality of the JPEG frame uploaded to the image model
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "85"))
+# Quality of WebP responses for clients that send "Accept: image/webp"
+RESPONSE_WEBP_QUALITY = int(os.getenv("RESPONSE_WEBP_QUALITY", "92"))
+# Encoder chunk size for Image.save (Pillow default is 64 KiB); 4 MiB covers
+# a 1024x1024 RGBA frame in one pass
+ImageFile.MAXBLOCK = max(ImageFile.MAXBLOCK, 4 * 1024 * 1024)
+
+# Shared upstream HTTP client (created at startup) so back-to-back generations
+# reuse pooled keep-alive connections instead of a new TLS handshake each time
+http_session: Optional[aiohttp.ClientSession] = None
+
+# Recent generations keyed by (input image digest, region, prompt) so repeated
+# requests (replays, demos) skip the upstream round-trip entirely
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "32"))
+generation_cache: "OrderedDict[tuple, Image.Image]" = OrderedDict()
+# Recently decoded input frames keyed by image digest; replay/demo loops resend
+# the same frame with only the target sector changing
+DECODE_CACHE_SIZE = int(os.getenv("DECODE_CACHE_SIZE", "8"))
+decode_cache: "OrderedDict[bytes, Image.Image]" = OrderedDict()
+# Upper bound on concurrent OpenRouter calls (e.g. from /generate_batch fan-out)
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "8"))
+generation_semaphore = asyncio.Semaphore(GENERATION_CONCURRENCY)
+
+# Retry policy and client-side rate limit for OpenRouter calls
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "4"))
+OPENROUTER_RPM = float(os.getenv("OPENROUTER_RPM", "60"))  # 0 disables the limiter
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Async token bucket: refills at rate tokens/s up to capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+openrouter_bucket = TokenBucket(OPENROUTER_RPM / 60.0, OPENROUTER_RPM) if OPENROUTER_RPM > 0 else None
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retry attempt+1: Retry-After if given, else exponential backoff with jitter."""
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return 2 ** attempt + random.random()
+
 
 # Session management
 # Use /app/assets which is mounted as a volume in Docker
 SESSIONS_DIR = Path("/app/assets/sessions") if Path("/app/assets").exists() else Path(__file__).parent / "sessions"
 session_manager = SessionManager(SESSIONS_DIR)
 replay_manager = ReplayManager(session_manager)
+# Pending session writes (png bytes, target, prompt, focus sector), drained by
+# a background task so disk I/O stays off the request path
+SESSION_SAVE_QUEUE_SIZE = int(os.getenv("SESSION_SAVE_QUEUE_SIZE", "64"))
+session_save_queue: Optional[asyncio.Queue] = None
+session_writer_task: Optional[asyncio.Task] = None
 
 
-class GenerateRequest(BaseModel):
+class GenerateParams(BaseModel):
     """
-    Request for sector-based inpainting.
+    Parameters for sector-based inpainting.
     Frontend sends which sector to modify (target_row, target_col).
     """
-    image_base64: str
     focus_x: float  # Where user is looking (normalized 0-1)
     focus_y: float  # For logging
     # Sector-based targeting (preferred)
@@ -66,23 +153,34 @@ class GenerateRequest(BaseModel):
     peripheral_size: float = 0.3
 
 
+class GenerateRequest(GenerateParams):
+    """JSON request for /generate: the parameters plus the base64-encoded image."""
+    image_base64: str
+
+
+class GenerateBatchRequest(BaseModel):
+    """
+    Request for several sectors of the same frame at once.
+    Each target is (row, col); sectors are generated concurrently.
+    """
+    image_base64: str
+    targets: List[Tuple[int, int]]
+    grid_size: int = 3
+
+
 def load_prompts():
     """Load prompts from file. One prompt per line, skip comments and empty lines."""
     global prompts
-    prompts = []
     
     if PROMPTS_FILE.exists():
-        with open(PROMPTS_FILE, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    prompts.append(line)
+        lines = (line.strip() for line in PROMPTS_FILE.read_text().splitlines())
+        prompts = tuple(line for line in lines if line and not line.startswith('#'))
         print(f"Loaded {len(prompts)} cycling prompts from {PROMPTS_FILE}")
     else:
-        prompts = [
+        prompts = (
             "add one more element to the image, photorealistic, high detail",
             "enhance the peripheral area, photorealistic, seamless blend",
-        ]
+        )
         print(f"Using {len(prompts)} default cycling prompts")
     
     for i, p in enumerate(prompts):
@@ -91,55 +189,68 @@ def load_prompts():
 
 def load_sector_prompts():
     """Load sector-specific prompts from JSON file. Supports both string and array formats."""
-    global sector_prompts, sector_prompt_indices, default_prompts
+    global sector_prompts, sector_prompt_slots, sector_prompt_lut, sector_prompt_indices, default_prompts
 
     if SECTOR_PROMPTS_FILE.exists():
         try:
-            with open(SECTOR_PROMPTS_FILE, 'r') as f:
-                data = json.load(f)
-            sector_prompts = data.get("sectors", {})
+            data = orjson.loads(SECTOR_PROMPTS_FILE.read_bytes())
+            sector_prompts = MappingProxyType({
+                sector: tuple(prompt_data) if isinstance(prompt_data, list) else prompt_data
+                for sector, prompt_data in data.get("sectors", {}).items()
+            })
 
             # Handle default as string or array
             default_val = data.get("default", default_prompts)
             if isinstance(default_val, str):
-                default_prompts = [default_val]
+                default_prompts = (default_val,)
             else:
-                default_prompts = default_val
+                default_prompts = tuple(default_val)
 
             # Initialize indices for each sector
-            for sector in sector_prompts:
-                sector_prompt_indices[sector] = 0
+            sector_prompt_slots = MappingProxyType({
+                sector: (slot, prompt_data) for slot, (sector, prompt_data) in enumerate(sector_prompts.items())
+            })
+            sector_prompt_indices = array.array('I', [0] * len(sector_prompts))
+            sector_prompt_lut = MappingProxyType({
+                (pos // 3, pos % 3): sector_prompt_slots[name]
+                for pos, name in enumerate(_SECTOR_NAMES) if name in sector_prompt_slots
+            })
 
             print(f"Loaded {len(sector_prompts)} sector-specific prompts from {SECTOR_PROMPTS_FILE}")
             for sector, prompt_data in sector_prompts.items():
-                if isinstance(prompt_data, list):
+                if isinstance(prompt_data, tuple):
                     print(f"  [{sector}] {len(prompt_data)} prompts, first: {prompt_data[0][:40]}...")
                 else:
                     print(f"  [{sector}] {prompt_data[:50]}...")
         except Exception as e:
             print(f"Error loading sector prompts: {e}")
-            sector_prompts = {}
+            sector_prompts = MappingProxyType({})
+            sector_prompt_slots = MappingProxyType({})
+            sector_prompt_lut = MappingProxyType({})
     else:
         print(f"No sector prompts file found at {SECTOR_PROMPTS_FILE}")
 
 
 def get_prompt_for_sector(row: int, col: int) -> str:
     """Get the prompt for a specific sector, cycling through available prompts."""
-    global sector_prompt_indices, default_prompt_index
-    name = sector_name(row, col)
-
-    # First try sector-specific prompt
-    if name in sector_prompts:
-        prompt_data = sector_prompts[name]
-
-        # Handle array of prompts (cycling)
-        if isinstance(prompt_data, list) and len(prompt_data) > 0:
+    global default_prompt_index
+
+    # First try sector-specific prompt (grid sectors resolve by position)
+    entry = sector_prompt_lut.get((row, col))
+    if entry is None and not (0 <= row < 3 and 0 <= col < 3):
+        entry = sector_prompt_slots.get(sector_name(row, col))
+    if entry is not None:
+        slot, prompt_data = entry
+
+        # Handle array of prompts (cycling). No await between read and
+        # advance, so concurrent requests on the event loop never interleave
+        if isinstance(prompt_data, tuple) and len(prompt_data) > 0:
             # Get current index for this sector
-            idx = sector_prompt_indices.get(name, 0)
+            idx = sector_prompt_indices[slot]
             prompt = prompt_data[idx]
             # Advance to next prompt for next time
-            sector_prompt_indices[name] = (idx + 1) % len(prompt_data)
-            print(f"Sector {name}: using prompt {idx + 1}/{len(prompt_data)}")
+            sector_prompt_indices[slot] = (idx + 1) % len(prompt_data)
+            print(f"Sector {sector_name(row, col)}: using prompt {idx + 1}/{len(prompt_data)}")
             return prompt
         elif isinstance(prompt_data, str):
             return prompt_data
@@ -168,93 +279,154 @@ def get_next_prompt():
     return prompt
 
 
-async def generate_with_openrouter(image: Image.Image, mask: Image.Image, prompt: str, region: tuple) -> Image.Image:
+class BufferPool:
+    """
+    Reusable BytesIO scratch buffers for transient encodes. Buffers are
+    rewound rather than truncated so they keep their grown capacity.
+    deque append/pop are atomic, so worker threads can share one pool.
+    """
+
+    def __init__(self, size: int = 8):
+        self._free = deque(maxlen=size)
+
+    @contextmanager
+    def checkout(self):
+        try:
+            buffer = self._free.pop()
+        except IndexError:
+            buffer = io.BytesIO()
+        buffer.seek(0)
+        try:
+            yield buffer
+        finally:
+            self._free.append(buffer)
+
+
+upload_buffers = BufferPool()
+
+
+def _encode_upload_sync(image: Image.Image) -> str:
+    with upload_buffers.checkout() as buffer:
+        image.convert("RGB").save(buffer, format="JPEG", quality=UPLOAD_JPEG_QUALITY)
+        size = buffer.tell()
+        # Views must be released before the buffer can be reused
+        with buffer.getbuffer() as view, view[:size] as upload:
+            return (b"data:image/jpeg;base64," + base64.b64encode(upload)).decode("ascii")
+
+
+async def encode_upload(image: Image.Image) -> str:
+    """
+    Convert image to a base64 data URL, encoding straight from a pooled buffer
+    and decoding to str once at the end. The model re-renders the whole
+    frame anyway, so a JPEG upload is much cheaper to encode and send than PNG.
+    """
+    return await asyncio.to_thread(_encode_upload_sync, image)
+
+
+async def generate_with_openrouter(image: Image.Image, mask: Image.Image, prompt: str, region: tuple,
+                                   data_url: Optional[str] = None) -> Image.Image:
     """
     Generate image using OpenRouter API with Gemini 2.5 Flash Image.
     Uses the modalities parameter to request image output.
+    Pass a precomputed data_url to reuse one upload encoding across calls.
     """
     if not OPENROUTER_API_KEY:
         raise ValueError("OPENROUTER_API_KEY not set")
 
-    # Convert image to base64
-    img_buffer = io.BytesIO()
-    image.save(img_buffer, format="PNG")
-    img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+    if data_url is None:
+        data_url = await encode_upload(image)
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            f"{OPENROUTER_BASE_URL}/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://github.com/ubicomp-capstone",
-            },
-            json={
-                "model": IMAGE_MODEL,
-                "messages": [
+    # Serialize with orjson: the body carries the multi-MB base64 data URL
+    payload = orjson.dumps({
+        "model": IMAGE_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": data_url
+                        }
+                    },
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{img_base64}"
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": f"Modify this image by adding or changing something in the region from pixel ({region[0]}, {region[1]}) to ({region[2]}, {region[3]}). The modification should be: {prompt}. Return the complete modified image."
-                            }
-                        ]
+                        "type": "text",
+                        "text": f"Modify this image by adding or changing something in the region from pixel ({region[0]}, {region[1]}) to ({region[2]}, {region[3]}). The modification should be: {prompt}. Return the complete modified image."
                     }
-                ],
-                # Required for image generation - tells OpenRouter we want image output
-                "modalities": ["image", "text"]
+                ]
             }
-        )
-
-        if response.status_code != 200:
-            error_text = response.text
-            print(f"OpenRouter API error: {response.status_code} - {error_text}")
-            raise Exception(f"OpenRouter API error: {response.status_code}")
-
-        result = response.json()
-        print(f"OpenRouter response keys: {result.keys()}")
-
-        # Handle response
-        choices = result.get("choices", [])
-        if not choices:
-            print("No choices in response")
-            raise Exception("No choices in API response")
-
-        message = choices[0].get("message", {})
-
-        # Images are returned in the "images" field (OpenRouter format)
-        images = message.get("images", [])
-        if images:
-            for img_item in images:
-                if img_item.get("type") == "image_url":
-                    img_url = img_item.get("image_url", {}).get("url", "")
-                    if img_url.startswith("data:image"):
-                        # Extract base64 data from data URL
-                        b64_data = img_url.split(",", 1)[1]
-                        print(f"Successfully extracted image from response ({len(b64_data)} bytes)")
-                        return Image.open(io.BytesIO(base64.b64decode(b64_data)))
-
-        # Fallback: check content field (some models may use this)
-        content = message.get("content", "")
-        if isinstance(content, list):
-            for item in content:
-                if isinstance(item, dict) and item.get("type") == "image_url":
-                    img_url = item.get("image_url", {}).get("url", "")
-                    if img_url.startswith("data:image"):
-                        b64_data = img_url.split(",", 1)[1]
-                        return Image.open(io.BytesIO(base64.b64decode(b64_data)))
-
-        # If we got here, no image was found
-        print(f"No image in response. Message keys: {message.keys()}")
-        print(f"Content preview: {str(content)[:200]}")
-        raise Exception("Model did not return an image")
+        ],
+        # Required for image generation - tells OpenRouter we want image output
+        "modalities": ["image", "text"]
+    })
+
+    # Retry rate limits, transient 5xx and connection errors with backoff
+    for attempt in range(OPENROUTER_MAX_RETRIES + 1):
+        if openrouter_bucket is not None:
+            await openrouter_bucket.acquire()
+        try:
+            async with http_session.post(
+                f"{OPENROUTER_BASE_URL}/chat/completions",
+                headers={
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": "https://github.com/ubicomp-capstone",
+                },
+                data=payload
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    print(f"OpenRouter API error: {response.status} - {error_text}")
+                    if response.status in RETRY_STATUSES and attempt < OPENROUTER_MAX_RETRIES:
+                        delay = retry_delay(attempt, response.headers.get("Retry-After"))
+                        print(f"Retrying in {delay:.1f}s (attempt {attempt + 1}/{OPENROUTER_MAX_RETRIES})")
+                        await asyncio.sleep(delay)
+                        continue
+                    raise Exception(f"OpenRouter API error: {response.status}")
+
+                result = orjson.loads(await response.read())
+                break
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt >= OPENROUTER_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt)
+            print(f"OpenRouter request failed ({e!r}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    print(f"OpenRouter response keys: {result.keys()}")
+
+    # Handle response
+    choices = result.get("choices", [])
+    if not choices:
+        print("No choices in response")
+        raise Exception("No choices in API response")
+
+    message = choices[0].get("message", {})
+
+    # Images are returned in the "images" field (OpenRouter format)
+    images = message.get("images", [])
+    if images:
+        for img_item in images:
+            if img_item.get("type") == "image_url":
+                img_url = img_item.get("image_url", {}).get("url", "")
+                if img_url.startswith("data:image"):
+                    # Extract base64 data from data URL
+                    b64_data = img_url.split(",", 1)[1]
+                    print(f"Successfully extracted image from response ({len(b64_data)} bytes)")
+                    return load_image_bytes(base64.b64decode(b64_data))
+
+    # Fallback: check content field (some models may use this)
+    content = message.get("content", "")
+    if isinstance(content, list):
+        for item in content:
+            if isinstance(item, dict) and item.get("type") == "image_url":
+                img_url = item.get("image_url", {}).get("url", "")
+                if img_url.startswith("data:image"):
+                    b64_data = img_url.split(",", 1)[1]
+                    return load_image_bytes(base64.b64decode(b64_data))
+
+    # If we got here, no image was found
+    print(f"No image in response. Message keys: {message.keys()}")
+    print(f"Content preview: {str(content)[:200]}")
+    raise Exception("Model did not return an image")
 
 
 async def generate_with_stability(image: Image.Image, mask: Image.Image, prompt: str) -> Image.Image:
@@ -262,37 +434,70 @@ async def generate_with_stability(image: Image.Image, mask: Image.Image, prompt:
     if not OPENROUTER_API_KEY:
         raise ValueError("OPENROUTER_API_KEY not set")
     
-    # Convert images to base64
-    img_buffer = io.BytesIO()
-    image.save(img_buffer, format="PNG")
-    img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-    
-    mask_buffer = io.BytesIO()
-    mask.save(mask_buffer, format="PNG")
-    mask_base64 = base64.b64encode(mask_buffer.getvalue()).decode()
+    # Encode images as PNG for the multipart upload
+    image_png = await asyncio.to_thread(encode_image, image)
+    mask_png = await asyncio.to_thread(encode_image, mask)
     
+    form = aiohttp.FormData()
+    form.add_field("image", image_png, filename="image.png", content_type="image/png")
+    form.add_field("mask", mask_png, filename="mask.png", content_type="image/png")
+    form.add_field("prompt", prompt)
+    form.add_field("output_format", "png")
+
     # Use Stability's edit endpoint
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            "https://api.stability.ai/v2beta/stable-image/edit/inpaint",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Accept": "image/*",
-            },
-            files={
-                "image": ("image.png", img_buffer.getvalue(), "image/png"),
-                "mask": ("mask.png", mask_buffer.getvalue(), "image/png"),
-            },
-            data={
-                "prompt": prompt,
-                "output_format": "png",
-            }
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Stability API error: {response.status_code}")
-        
-        return Image.open(io.BytesIO(response.content))
+    async with http_session.post(
+        "https://api.stability.ai/v2beta/stable-image/edit/inpaint",
+        headers={
+            "Accept": "image/*",
+        },
+        data=form,
+    ) as response:
+        if response.status != 200:
+            raise Exception(f"Stability API error: {response.status}")
+        content = await response.read()
+
+    return load_image_bytes(content)
+
+
+@functools.lru_cache(maxsize=32)
+def _shape_levels(shape_type: int, size: int) -> np.ndarray:
+    """
+    Rasterize a fallback shape on a (2*size+1)^2 grid centered on the middle pixel.
+    Returns uint8 palette levels: 0 = untouched, 1..3 = fill (3 only for the
+    outer ring of the concentric circles).
+    """
+    yy, xx = np.ogrid[-size:size + 1, -size:size + 1]
+    if shape_type == 0:
+        # Filled circle
+        inside = xx * xx + yy * yy <= size * size
+    elif shape_type == 1:
+        # Five-pointed star (even-odd test against the 10-vertex polygon)
+        i = np.arange(10)
+        angle = i * math.pi / 5 - math.pi / 2
+        radii = np.where(i % 2 == 0, size, size // 2)
+        px, py = radii * np.cos(angle), radii * np.sin(angle)
+        qx, qy = np.roll(px, -1), np.roll(py, -1)
+        inside = np.zeros((2 * size + 1, 2 * size + 1), dtype=bool)
+        for ax, ay, bx, by in zip(px, py, qx, qy):
+            if ay == by:
+                continue
+            crosses = (ay > yy) != (by > yy)
+            inside ^= crosses & (xx < (bx - ax) * (yy - ay) / (by - ay) + ax)
+    elif shape_type == 2:
+        # Triangle with apex at top
+        inside = 2 * np.abs(xx) <= yy + size
+    elif shape_type == 3:
+        # Concentric circles: innermost ring gets the darkest shade
+        dist2 = xx * xx + yy * yy
+        levels = np.zeros(dist2.shape, dtype=np.uint8)
+        for level in range(3, 0, -1):
+            radius = size * level // 3
+            levels[dist2 <= radius * radius] = level
+        return levels
+    else:
+        # Diamond/rhombus
+        inside = np.abs(xx) + np.abs(yy) <= size
+    return np.broadcast_to(inside, (2 * size + 1, 2 * size + 1)).astype(np.uint8)
 
 
 def simple_composite_edit(image: Image.Image, mask: Image.Image, prompt: str, region: tuple) -> Image.Image:
@@ -300,12 +505,6 @@ def simple_composite_edit(image: Image.Image, mask: Image.Image, prompt: str, re
     Visible fallback: Draw obvious shapes/patterns in the target region.
     Use this when API is unavailable for testing - makes changes clearly visible.
     """
-    import random
-    import math
-
-    result = image.copy()
-    draw = ImageDraw.Draw(result)
-
     x1, y1, x2, y2 = region
     region_w = x2 - x1
     region_h = y2 - y1
@@ -313,82 +512,125 @@ def simple_composite_edit(image: Image.Image, mask: Image.Image, prompt: str, re
     center_y = (y1 + y2) // 2
 
     # Use prompt hash for deterministic but varied results
+    # (local Random so concurrent fallbacks don't reseed the shared generator)
     seed = hash(prompt) % 10000
-    random.seed(seed)
+    rng = random.Random(seed)
 
     # Generate a vibrant color
-    hue = random.random()
-    r = int(255 * (0.5 + 0.5 * math.sin(hue * 6.28)))
-    g = int(255 * (0.5 + 0.5 * math.sin(hue * 6.28 + 2.09)))
-    b = int(255 * (0.5 + 0.5 * math.sin(hue * 6.28 + 4.18)))
+    phase = rng.random() * 6.28
+    r = int(255 * (0.5 + 0.5 * math.sin(phase)))
+    g = int(255 * (0.5 + 0.5 * math.sin(phase + 2.09)))
+    b = int(255 * (0.5 + 0.5 * math.sin(phase + 4.18)))
     color = (r, g, b)
 
     # Choose a shape type based on prompt hash
     shape_type = seed % 5
 
-    if shape_type == 0:
-        # Draw a filled circle
-        radius = min(region_w, region_h) // 3
-        draw.ellipse([center_x - radius, center_y - radius,
-                      center_x + radius, center_y + radius], fill=color)
-    elif shape_type == 1:
-        # Draw a star
-        points = []
-        outer_r = min(region_w, region_h) // 3
-        inner_r = outer_r // 2
-        for i in range(10):
-            angle = i * math.pi / 5 - math.pi / 2
-            r = outer_r if i % 2 == 0 else inner_r
-            points.append((center_x + r * math.cos(angle), center_y + r * math.sin(angle)))
-        draw.polygon(points, fill=color)
-    elif shape_type == 2:
-        # Draw a triangle
-        size = min(region_w, region_h) // 3
-        points = [
-            (center_x, center_y - size),
-            (center_x - size, center_y + size),
-            (center_x + size, center_y + size)
-        ]
-        draw.polygon(points, fill=color)
-    elif shape_type == 3:
-        # Draw concentric circles
-        for i in range(3, 0, -1):
-            radius = min(region_w, region_h) // 3 * i // 3
-            shade = (r * i // 3, g * i // 3, b * i // 3)
-            draw.ellipse([center_x - radius, center_y - radius,
-                          center_x + radius, center_y + radius], fill=shade)
+    # Palette indexed by shape level; levels 1..3 only differ for concentric circles
+    if shape_type == 3:
+        palette = np.array([(0, 0, 0)] + [(r * i // 3, g * i // 3, b * i // 3) for i in (1, 2, 3)], dtype=np.uint8)
     else:
-        # Draw a diamond/rhombus
-        size = min(region_w, region_h) // 3
-        points = [
-            (center_x, center_y - size),
-            (center_x + size, center_y),
-            (center_x, center_y + size),
-            (center_x - size, center_y)
-        ]
-        draw.polygon(points, fill=color)
+        palette = np.array([(0, 0, 0)] + [color] * 3, dtype=np.uint8)
+
+    # Blit the cached shape mask into the image array, clipped to the image bounds
+    arr = np.array(image.convert("RGB"))
+    size = min(region_w, region_h) // 3
+    levels = _shape_levels(shape_type, size)
+    top, left = center_y - size, center_x - size
+    y0, x0 = max(top, 0), max(left, 0)
+    y1c, x1c = min(top + levels.shape[0], arr.shape[0]), min(left + levels.shape[1], arr.shape[1])
+    if y1c > y0 and x1c > x0:
+        window = levels[y0 - top:y1c - top, x0 - left:x1c - left]
+        target = arr[y0:y1c, x0:x1c]
+        hit = window > 0
+        target[hit] = palette[window[hit]]
+    result = Image.fromarray(arr)
 
     # Add a subtle border around the region to show what was modified
-    draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
+    ImageDraw.Draw(result).rectangle([x1, y1, x2, y2], outline=color, width=3)
 
     print(f"Fallback: drew shape {shape_type} in color {color} at region {region}")
     return result
 
 
+@functools.lru_cache(maxsize=64)
 def create_mask(image_size, region):
-    """Create mask where region is white (to be inpainted)."""
+    """
+    Create mask where region is white (to be inpainted).
+    Memoized per (size, region) - a grid only has a handful - so callers must not mutate it.
+    """
     mask = Image.new("L", image_size, 0)
-    draw = ImageDraw.Draw(mask)
-    draw.rectangle(region, fill=255)
+    x1, y1, x2, y2 = region
+    # Inclusive corners, matching ImageDraw.rectangle
+    mask.paste(255, (x1, y1, x2 + 1, y2 + 1))
     return mask
 
 
+def encode_image(image: Image.Image, format: str = "PNG", **params) -> memoryview:
+    """
+    Encode a PIL Image, returning a zero-copy view of the encoder buffer
+    (Response, base64 and file writes all accept it). CPU-bound; call via
+    asyncio.to_thread from handlers.
+    """
+    # Encoder chunk size comes from ImageFile.MAXBLOCK (raised at import);
+    # Pillow's save() has no per-call buffer size argument
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getbuffer()
+
+
+def load_image_bytes(image_data: bytes) -> Image.Image:
+    """Open encoded image bytes and decode them now.
+
+    PIL decodes lazily from the open file pointer, which is not thread-safe;
+    generated images are cached and later encoded from worker threads.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    return image
+
+
+def decode_image_bytes(image_data: bytes) -> Image.Image:
+    """Decode encoded image bytes (PNG/JPEG/...) to an RGB PIL Image."""
+    image = Image.open(io.BytesIO(image_data))
+    if image.mode == "RGB":
+        # Already RGB: decode in place rather than paying for convert()'s copy
+        image.load()
+        return image
+    return image.convert("RGB")
+
+
 def decode_base64_image(base64_str: str) -> Image.Image:
     """Decode base64 string to PIL Image."""
     if "," in base64_str:
         base64_str = base64_str.split(",", 1)[1]
-    image_data = base64.b64decode(base64_str)
-    return Image.open(io.BytesIO(image_data)).convert("RGB")
+    return decode_image_bytes(base64.b64decode(base64_str))
+
+
+# Leading base64 characters / raw bytes of the JPEG signature. PNG input (what
+# the frontend sends) is not passed through: it is re-encoded as a smaller JPEG
+_JPEG_B64_PREFIX = "/9j/"
+_JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+
+def passthrough_data_url(base64_str: Union[str, bytes]) -> Optional[str]:
+    """
+    Build an upload data URL straight from the incoming image (base64 string
+    or raw bytes) when it is already JPEG, so the upload needs no re-encode.
+    Returns None for any other format, which then goes through encode_upload.
+    """
+    if isinstance(base64_str, bytes):
+        if base64_str.startswith(_JPEG_SIGNATURE):
+            return "data:image/jpeg;base64," + base64.b64encode(base64_str).decode("ascii")
+        return None
+    if base64_str.startswith("data:"):
+        header, _, payload = base64_str.partition(",")
+        if header == "data:image/jpeg;base64":
+            return base64_str
+        base64_str = payload
+    if base64_str.startswith(_JPEG_B64_PREFIX):
+        return f"data:image/jpeg;base64,{base64_str}"
+    return None
 
 
 def calculate_sector_region(row: int, col: int, grid_size: int,
@@ -414,6 +656,22 @@ def calculate_sector_region(row: int, col: int, grid_size: int,
     return (x1, y1, x2, y2)
 
 
+@functools.lru_cache(maxsize=16)
+def _sector_table(img_width: int, img_height: int, grid_size: int) -> tuple:
+    """All sector regions for one image size and grid, indexed by row * grid_size + col."""
+    return tuple(
+        calculate_sector_region(r, c, grid_size, img_width, img_height)
+        for r in range(grid_size) for c in range(grid_size)
+    )
+
+
+def sector_region(row: int, col: int, grid_size: int, img_width: int, img_height: int):
+    """Cached lookup of calculate_sector_region for in-grid sectors."""
+    if 0 <= row < grid_size and 0 <= col < grid_size:
+        return _sector_table(img_width, img_height, grid_size)[row * grid_size + col]
+    return calculate_sector_region(row, col, grid_size, img_width, img_height)
+
+
 def calculate_opposite_region(focus_x: float, focus_y: float, 
                               img_width: int, img_height: int, 
                               size_fraction: float = 0.3):
@@ -437,17 +695,28 @@ def calculate_opposite_region(focus_x: float, focus_y: float,
     return (x1, y1, x2, y2)
 
 
+# Row-major 3x3 names: Top/Middle/Bottom x Left/Center/Right
+_SECTOR_NAMES = ("TL", "TC", "TR", "ML", "MC", "MR", "BL", "BC", "BR")
+
+
 def sector_name(row: int, col: int) -> str:
     """Get human-readable sector name."""
-    row_names = ["T", "M", "B"]  # Top, Middle, Bottom
-    col_names = ["L", "C", "R"]  # Left, Center, Right
-    if row < len(row_names) and col < len(col_names):
-        return f"{row_names[row]}{col_names[col]}"
+    if 0 <= row < 3 and 0 <= col < 3:
+        return _SECTOR_NAMES[row * 3 + col]
     return f"({row},{col})"
 
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
+    global http_session
+    http_session = aiohttp.ClientSession(
+        headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"},
+        timeout=aiohttp.ClientTimeout(total=120.0),
+        connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300, keepalive_timeout=60),
+    )
+    global session_save_queue, session_writer_task
+    session_save_queue = asyncio.Queue(maxsize=SESSION_SAVE_QUEUE_SIZE)
+    session_writer_task = asyncio.create_task(session_writer_loop())
     load_prompts()
     load_sector_prompts()
     print(f"OpenRouter API Key: {'✓ Set' if OPENROUTER_API_KEY else '✗ Not set'}")
@@ -459,6 +728,41 @@ def startup_event():
     print(f"All generations will be saved to: {SESSIONS_DIR}/{session_id}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if http_session is not None:
+        await http_session.close()
+    if session_writer_task is not None:
+        # Flush queued saves before exiting
+        await session_save_queue.join()
+        session_writer_task.cancel()
+    session_manager.close_session()
+
+
+async def session_writer_loop():
+    """Write queued generations to the current session in order."""
+    while True:
+        item = await session_save_queue.get()
+        try:
+            await asyncio.to_thread(session_manager.save_generation, *item)
+        except Exception as e:
+            print(f"Session save failed: {e}")
+        finally:
+            session_save_queue.task_done()
+
+
+def queue_session_save(image: Union[Image.Image, memoryview], target: str, prompt: str, focus_sector: str):
+    """
+    Queue a session write, dropping the oldest pending one if the queue is full.
+    Pass PNG bytes when already encoded; a PIL image is PNG-encoded by the writer.
+    """
+    if session_save_queue.full():
+        session_save_queue.get_nowait()
+        session_save_queue.task_done()
+        print("Session save queue full - dropping oldest pending save")
+    session_save_queue.put_nowait((image, target, prompt, focus_sector))
+
+
 @app.get("/health")
 async def health():
     return {
@@ -493,6 +797,8 @@ async def reset_prompt_index():
 @app.post("/session/start")
 async def start_session(session_id: Optional[str] = None):
     """Start a new recording session."""
+    # Let queued saves land in the session they were generated for
+    await session_save_queue.join()
     sid = session_manager.start_new_session(session_id)
     return {
         "session_id": sid,
@@ -545,17 +851,15 @@ async def replay_next():
     if not replay_manager.is_replaying():
         raise HTTPException(status_code=400, detail="Not in replay mode")
     
-    entry = replay_manager.get_next_generation()
+    entry = await asyncio.to_thread(replay_manager.get_next_generation)
     if not entry:
         return {"status": "complete", "image": None}
+    if entry["image_bytes"] is None:
+        raise HTTPException(status_code=404, detail=f"Missing image {entry['filename']}")
     
-    # Return image as PNG
-    img_byte_arr = io.BytesIO()
-    entry["image"].save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
-    
+    # Sessions store PNGs, so the file is returned without a decode/re-encode
     return Response(
-        content=img_byte_arr.getvalue(),
+        content=entry["image_bytes"],
         media_type="image/png",
         headers={
             "X-Sector": entry["target_sector"],
@@ -565,22 +869,120 @@ async def replay_next():
     )
 
 
+def image_digest(image_data: Union[str, bytes]) -> bytes:
+    """Digest of the full incoming image (base64 string or raw bytes), used as a cache key."""
+    if isinstance(image_data, str):
+        image_data = image_data.encode()
+    return hashlib.blake2b(image_data, digest_size=16).digest()
+
+
+async def decode_cached(image_data: Union[str, bytes], digest: bytes) -> Image.Image:
+    """
+    Decode the incoming frame (base64 string or raw bytes) off the event loop,
+    reusing recent decodes of the same image.
+    """
+    image = decode_cache.get(digest)
+    if image is not None:
+        decode_cache.move_to_end(digest)
+        return image
+    decode = decode_base64_image if isinstance(image_data, str) else decode_image_bytes
+    image = await asyncio.to_thread(decode, image_data)
+    if DECODE_CACHE_SIZE > 0:
+        decode_cache[digest] = image
+        if len(decode_cache) > DECODE_CACHE_SIZE:
+            decode_cache.popitem(last=False)
+    return image
+
+
+async def generate_for_region(init_image: Image.Image, digest: bytes, mask_image: Image.Image,
+                              prompt: str, region: tuple, data_url: Optional[str] = None) -> Image.Image:
+    """
+    Run one OpenRouter generation through the cache and concurrency limit.
+    Returns the original image unchanged if the API is unavailable or fails.
+    """
+    if not OPENROUTER_API_KEY:
+        print("No API key set - returning original image")
+        return init_image
+    try:
+        cache_key = (digest, region, prompt)
+        generated_image = generation_cache.get(cache_key)
+        if generated_image is not None:
+            generation_cache.move_to_end(cache_key)
+            print("Generation cache hit - skipping OpenRouter call")
+            return generated_image
+        async with generation_semaphore:
+            generated_image = await generate_with_openrouter(init_image, mask_image, prompt, region, data_url)
+        if GENERATION_CACHE_SIZE > 0:
+            generation_cache[cache_key] = generated_image
+            if len(generation_cache) > GENERATION_CACHE_SIZE:
+                generation_cache.popitem(last=False)
+        return generated_image
+    except Exception as api_err:
+        print(f"OpenRouter API failed: {api_err}")
+        # Return original image unchanged instead of fallback shapes
+        return init_image
+
+
 @app.post("/generate")
-async def generate(request: GenerateRequest):
+async def generate(request: GenerateRequest, accept: Optional[str] = Header(None)):
     """
     Generate modified image using OpenRouter API.
     If target_row/col provided: use precise sector
     Otherwise: use legacy opposite-region calculation
+    Returns WebP when the client accepts image/webp, PNG otherwise.
     """
+    # Hash off the event loop (blake2b releases the GIL on large inputs)
+    digest = await asyncio.to_thread(image_digest, request.image_base64)
     try:
-        init_image = decode_base64_image(request.image_base64)
+        init_image = await decode_cached(request.image_base64, digest)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to decode image: {str(e)}")
     
+    return await generate_response(
+        request, init_image, digest, passthrough_data_url(request.image_base64), accept
+    )
+
+
+@app.post("/generate_bin")
+async def generate_bin(request: Request,
+                       focus_x: float,
+                       focus_y: float,
+                       target_row: Optional[int] = None,
+                       target_col: Optional[int] = None,
+                       grid_size: int = 3,
+                       peripheral_size: float = 0.3,
+                       accept: Optional[str] = Header(None)):
+    """
+    Same as /generate, but the image is the raw request body (PNG/JPEG bytes,
+    e.g. application/octet-stream) and the parameters are query arguments.
+    Skips the base64 transport overhead and decode pass.
+    """
+    image_data = await request.body()
+    digest = await asyncio.to_thread(image_digest, image_data)
+    try:
+        init_image = await decode_cached(image_data, digest)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to decode image: {str(e)}")
+    
+    params = GenerateParams(
+        focus_x=focus_x,
+        focus_y=focus_y,
+        target_row=target_row,
+        target_col=target_col,
+        grid_size=grid_size,
+        peripheral_size=peripheral_size,
+    )
+    data_url = await asyncio.to_thread(passthrough_data_url, image_data)
+    return await generate_response(params, init_image, digest, data_url, accept)
+
+
+async def generate_response(request: GenerateParams, init_image: Image.Image, digest: bytes,
+                            data_url: Optional[str], accept: Optional[str]) -> Response:
+    """Shared body of /generate and /generate_bin once the input frame is decoded."""
     try:
         # Prefer sector-based targeting if provided
         if request.target_row is not None and request.target_col is not None:
-            region = calculate_sector_region(
+            region = sector_region(
                 request.target_row,
                 request.target_col,
                 request.grid_size,
@@ -610,18 +1012,23 @@ async def generate(request: GenerateRequest):
         mask_image = create_mask(init_image.size, region)
         
         # Generate using OpenRouter (no fallback - only show real generated images)
-        if OPENROUTER_API_KEY:
-            try:
-                generated_image = await generate_with_openrouter(init_image, mask_image, prompt, region)
-            except Exception as api_err:
-                print(f"OpenRouter API failed: {api_err}")
-                # Return original image unchanged instead of fallback shapes
-                generated_image = init_image
+        generated_image = await generate_for_region(
+            init_image, digest, mask_image, prompt, region, data_url
+        )
+        
+        # Encode the response off the event loop. WebP encodes faster and
+        # smaller than PNG's single-threaded deflate
+        if accept and "image/webp" in accept:
+            media_type = "image/webp"
+            body = await asyncio.to_thread(
+                encode_image, generated_image, "WEBP", quality=RESPONSE_WEBP_QUALITY, method=4
+            )
         else:
-            print("No API key set - returning original image")
-            generated_image = init_image
+            media_type = "image/png"
+            body = await asyncio.to_thread(encode_image, generated_image)
         
-        # Save to session if recording
+        # Save to session if recording (sessions store PNG: reuse the response
+        # bytes, or let the writer encode when the response was WebP)
         if session_manager.current_session_id:
             # Determine focus sector for logging (opposite of target)
             if request.target_row is not None and request.target_col is not None:
@@ -632,21 +1039,11 @@ async def generate(request: GenerateRequest):
             else:
                 focus_sector = "unknown"
             
-            session_manager.save_generation(
-                generated_image,
-                target,
-                prompt,
-                focus_sector
-            )
-        
-        # Return as PNG
-        img_byte_arr = io.BytesIO()
-        generated_image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+            queue_session_save(body if media_type == "image/png" else generated_image, target, prompt, focus_sector)
         
         return Response(
-            content=img_byte_arr.getvalue(), 
-            media_type="image/png",
+            content=body,
+            media_type=media_type,
             headers={
                 "X-Prompt-Used": prompt[:100],
                 "X-Prompt-Index": str(prompt_index - 1),
@@ -659,10 +1056,66 @@ async def generate(request: GenerateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/generate_batch")
+async def generate_batch(request: GenerateBatchRequest):
+    """
+    Generate several sectors of the same frame concurrently.
+    The image is decoded and encoded for upload once and shared by every call.
+    Returns JSON with one base64 PNG per target, in request order.
+    """
+    digest = await asyncio.to_thread(image_digest, request.image_base64)
+    try:
+        init_image = await decode_cached(request.image_base64, digest)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to decode image: {str(e)}")
+
+    try:
+        data_url = passthrough_data_url(request.image_base64)
+        if data_url is None and OPENROUTER_API_KEY:
+            data_url = await encode_upload(init_image)
+
+        # Pick regions and prompts up front so prompt cycling stays in request order
+        jobs = []
+        for row, col in request.targets:
+            region = sector_region(row, col, request.grid_size, init_image.width, init_image.height)
+            jobs.append((row, col, region, get_prompt_for_sector(row, col)))
+        print(f"Batch: generating {len(jobs)} sectors concurrently")
+
+        generated_images = await asyncio.gather(*[
+            generate_for_region(init_image, digest, create_mask(init_image.size, region), prompt, region, data_url)
+            for _, _, region, prompt in jobs
+        ])
+        png_images = await asyncio.gather(*[
+            asyncio.to_thread(encode_image, image) for image in generated_images
+        ])
+
+        results = []
+        for (row, col, _, prompt), generated_image, png_bytes in zip(jobs, generated_images, png_images):
+            target = sector_name(row, col)
+            if session_manager.current_session_id:
+                focus_sector = sector_name((request.grid_size - 1) - row, (request.grid_size - 1) - col)
+                queue_session_save(png_bytes, target, prompt, focus_sector)
+            results.append({
+                "target_sector": target,
+                "prompt": prompt,
+                "image_base64": "data:image/png;base64," + base64.b64encode(png_bytes).decode("ascii"),
+            })
+        return Response(content=orjson.dumps({"results": results}), media_type="application/json")
+
+    except Exception as e:
+        print(f"Batch generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", default="127.0.0.1", help="Host to bind to")
     parser.add_argument("--port", type=int, default=8001, help="Port to bind to")
+    # uvloop/httptools ship with uvicorn[standard]; uvloop has no Windows build
+    parser.add_argument("--loop", default="asyncio" if sys.platform == "win32" else "uvloop",
+                        help="Event loop implementation")
+    parser.add_argument("--http", default="httptools", help="HTTP protocol implementation")
     args = parser.parse_args()
     
-    uvicorn.run(app, host=args.host, port=args.port)
+    # Single worker: prompt cycling, caches and the session writer are process-local
+    uvicorn.run(app, host=args.host, port=args.port, loop=args.loop, http=args.http)
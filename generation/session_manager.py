@@ -5,7 +5,7 @@ Saves generated images and metadata to disk for replay.
 import json
 import time
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 from PIL import Image
 import io
 import base64
@@ -22,6 +22,7 @@ class SessionManager:
         
     def start_new_session(self, session_id: Optional[str] = None) -> str:
         """Start a new recording session."""
+        self.close_session()
         if session_id is None:
             session_id = f"session_{int(time.time())}"
         
@@ -33,26 +34,33 @@ class SessionManager:
         self.metadata = {
             "session_id": session_id,
             "created_at": time.time(),
+            "closed": False,
             "sequence": []
         }
         
         self._save_metadata()
+        # Truncate: a reused session id must not keep the previous run's entries
+        (self.current_session_dir / "metadata.jsonl").write_text("")
         print(f"Started session: {session_id}")
         return session_id
     
     def save_generation(self, 
-                       image: Image.Image, 
+                       image: Union[Image.Image, bytes, memoryview], 
                        sector_name: str,
                        prompt: str,
                        focus_sector: str) -> Dict:
-        """Save a generated image and its metadata."""
+        """Save a generated image (PIL image or encoded PNG bytes) and its metadata."""
         if not self.current_session_dir:
             raise ValueError("No active session. Call start_new_session() first.")
         
         # Save image
         filename = f"{self.sequence_index:04d}_{sector_name}.png"
         image_path = self.current_session_dir / filename
-        image.save(image_path, "PNG")
+        if isinstance(image, (bytes, memoryview)):
+            image_path.write_bytes(image)
+        else:
+            # Fast deflate: session frames are written once and read back rarely
+            image.save(image_path, "PNG", compress_level=1)
         
         # Create metadata entry
         entry = {
@@ -64,14 +72,22 @@ class SessionManager:
             "timestamp": time.time()
         }
         
+        # Append-only log keeps each save O(1); metadata.json is rewritten on close
         self.metadata["sequence"].append(entry)
-        self._save_metadata()
+        with open(self.current_session_dir / "metadata.jsonl", 'a') as f:
+            f.write(json.dumps(entry) + "\n")
         
         self.sequence_index += 1
         print(f"Saved generation {self.sequence_index}: {sector_name}")
         
         return entry
     
+    def close_session(self):
+        """Consolidate the current session's sequence into metadata.json."""
+        if self.current_session_dir:
+            self.metadata["closed"] = True
+            self._save_metadata()
+
     def _save_metadata(self):
         """Save session metadata to JSON."""
         if self.current_session_dir:
@@ -87,12 +103,23 @@ class SessionManager:
         """Load a saved session's metadata."""
         session_dir = self.sessions_dir / session_id
         metadata_path = session_dir / "metadata.json"
-        
-        if not metadata_path.exists():
+        log_path = session_dir / "metadata.jsonl"
+        
+        if metadata_path.exists():
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+        elif log_path.exists():
+            metadata = {"session_id": session_id, "sequence": []}
+        else:
             raise FileNotFoundError(f"Session {session_id} not found")
         
-        with open(metadata_path, 'r') as f:
-            return json.load(f)
+        # Sessions that were not closed cleanly only have their entries in the log.
+        # Older sessions predate the "closed" flag and the log, so they keep metadata.json.
+        if not metadata.get("closed", True) or not metadata_path.exists():
+            if log_path.exists():
+                with open(log_path, 'r') as f:
+                    metadata["sequence"] = [json.loads(line) for line in f if line.strip()]
+        return metadata
     
     def get_image(self, session_id: str, index: int) -> Optional[Image.Image]:
         """Load a specific image from a session."""
@@ -109,6 +136,13 @@ class SessionManager:
             return None
         
         return Image.open(image_path)
+    
+    def get_image_bytes(self, session_id: str, filename: str) -> Optional[bytes]:
+        """Read a saved image's encoded PNG bytes without decoding them."""
+        image_path = self.sessions_dir / session_id / filename
+        if not image_path.exists():
+            return None
+        return image_path.read_bytes()
 
 
 class ReplayManager:
@@ -139,15 +173,15 @@ class ReplayManager:
         entry = self.replay_metadata["sequence"][self.replay_index]
         self.replay_index += 1
         
-        # Load the image
-        image = self.session_manager.get_image(
+        # Load the stored PNG as-is; it is served without re-encoding
+        image_bytes = self.session_manager.get_image_bytes(
             self.replay_session_id,  # Now guaranteed to be str, not None
-            entry["index"]
+            entry["filename"]
         )
         
         return {
             **entry,
-            "image": image
+            "image_bytes": image_bytes
         }
     
     def is_replaying(self) -> bool:
@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 from pupil_labs.real_time_screen_gaze import marker_generator
 import cv2
+import numpy as np
 
 # Output directory for markers
 OUTPUT_DIR = Path("frontend/public/assets/markers")
@@ -12,10 +13,16 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 TARGET_SIZE = 512
 for marker_id in range(4):
     img = marker_generator.generate_marker(marker_id=marker_id)
-    # Resize to target size using NEAREST interpolation for crisp edges
-    img_resized = cv2.resize(img, (TARGET_SIZE, TARGET_SIZE), interpolation=cv2.INTER_NEAREST)
+    # Resize to target size using NEAREST interpolation for crisp edges; an integer
+    # scale is plain pixel repetition, so skip the interpolation path for it
+    scale, remainder = divmod(TARGET_SIZE, img.shape[0])
+    if remainder == 0 and img.shape[0] == img.shape[1]:
+        img_resized = np.repeat(np.repeat(img, scale, axis=0), scale, axis=1)
+    else:
+        img_resized = cv2.resize(img, (TARGET_SIZE, TARGET_SIZE), interpolation=cv2.INTER_NEAREST)
     out_path = OUTPUT_DIR / f"tag36_11_{marker_id:05d}.png"
-    cv2.imwrite(str(out_path), img_resized)
+    # Two-tone images compress well even at the fastest zlib level
+    cv2.imwrite(str(out_path), img_resized, [cv2.IMWRITE_PNG_COMPRESSION, 1])
     print(f"Generated {out_path} ({TARGET_SIZE}x{TARGET_SIZE})")
 
 print("Done generating AprilTag markers.")
@@ -109,7 +109,7 @@ cleanup() {
 trap cleanup INT TERM
 
 log "Starting backend on port $BACKEND_PORT"
-spawn "backend" bash -c "cd '$ROOT_DIR/backend' && PATCH_ASSETS_DIR='$ROOT_DIR/assets/patches' '$PYTHON_BIN' -m uvicorn app.main:app --host 0.0.0.0 --port $BACKEND_PORT"
+spawn "backend" bash -c "cd '$ROOT_DIR/backend' && PATCH_ASSETS_DIR='$ROOT_DIR/assets/patches' '$PYTHON_BIN' -m uvicorn app.main:app --host 0.0.0.0 --port $BACKEND_PORT --loop uvloop --ws-per-message-deflate false"
 
 log "Starting frontend on port $FRONTEND_PORT"
 spawn "frontend" bash -c "cd '$ROOT_DIR/frontend/public' && '$PYTHON_BIN' -m http.server $FRONTEND_PORT"
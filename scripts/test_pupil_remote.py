@@ -41,10 +41,13 @@ def main() -> None:
     samples = 0
     try:
         while time.time() - start < args.duration:
+            # Wait on the socket rather than sleeping, so a fast stream is read at
+            # its native rate and the loop still wakes to check the deadline
+            if not sub.poll(50):
+                continue
             try:
                 topic, payload = sub.recv_multipart(flags=zmq.NOBLOCK)
             except zmq.Again:
-                time.sleep(0.05)
                 continue
             obj = msgpack.loads(payload, raw=False)
             if not isinstance(obj, dict):